@@ -1,13 +1,23 @@
 import os
-import json
+import sys
+import signal
+import re
+import mmap
+import atexit
 import csv
 import time
 import datetime
+import threading
 from io import StringIO
+from operator import itemgetter
+from concurrent.futures import Future
 from dotenv import load_dotenv
 
+import orjson
+
 import google.generativeai as genai
-from flask import Flask, request, jsonify, render_template, make_response
+from flask import Flask, request, render_template, make_response, Response, stream_with_context
+from markupsafe import Markup
 
 # Load env variables
 load_dotenv()
@@ -19,10 +29,6 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY not found in environment variables.")
 
-# Configure Gemini
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel(model_name="gemini-2.5-flash")
-
 # Emotion categories
 EMOTION_CATEGORIES = [
     "Happy/Engaged",
@@ -31,43 +37,364 @@ EMOTION_CATEGORIES = [
     "Bored/Drowsy",
     "Frustrated/Stressed"
 ]
-
-DATA_FILE = 'data.json'
+NEGATIVE_EMOTIONS = frozenset({"Confused", "Frustrated/Stressed", "Bored/Drowsy"})
+
+# Keyword patterns for feedback clear enough to classify without the API
+KEYWORD_PATTERNS = {
+    "Happy/Engaged": re.compile(r"\b(great|loved?|enjoy(?:ed)?|amazing|engaging|fun|interesting|excellent|awesome)\b", re.I),
+    "Confused": re.compile(r"\b(confus(?:ed|ing)|unclear|hard to follow)\b", re.I),
+    "Bored/Drowsy": re.compile(r"\b(bor(?:ed|ing)|sleepy|drowsy|dull|monotonous)\b", re.I),
+    "Frustrated/Stressed": re.compile(r"\b(frustrat(?:ed|ing)|stress(?:ed|ful)|overwhelm(?:ed|ing)|annoy(?:ed|ing))\b", re.I),
+}
+# Negations can flip a keyword's meaning ("not engaging", "nothing interesting"),
+# and wishes or comparisons ("wish it were more fun") describe what was missing;
+# when in doubt, leave it to the model
+NEGATION_RE = re.compile(r"\b(not|no|never|hardly|barely|nothing|nobody|none|neither|nor|without|lack\w*)\b|n't|\bdont\b", re.I)
+AMBIGUOUS_RE = re.compile(r"\b(wish\w*|hop(?:e|ed|ing)|would|could|should|if|more|less|rather)\b", re.I)
+
+# Request settings are built once and shared by every classification call
+SYSTEM_INSTRUCTION = (
+    f"Classify the student feedback you are given into one emotion from this list: {EMOTION_CATEGORIES}.\n"
+    "Respond in JSON with: emotion, reasoning."
+)
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "emotion": {"type": "STRING"},
+        "reasoning": {"type": "STRING"}
+    },
+    "required": ["emotion", "reasoning"]
+}
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": RESPONSE_SCHEMA
+}
+
+# Configure Gemini; the model's client keeps its connection open across requests
+genai.configure(api_key=GEMINI_API_KEY)
+model = genai.GenerativeModel(
+    model_name="gemini-2.5-flash",
+    system_instruction=SYSTEM_INSTRUCTION,
+    generation_config=GENERATION_CONFIG
+)
+
+DATA_FILE = 'data.jsonl'
+# Pre-JSON-lines store, converted once at startup if DATA_FILE doesn't exist yet
+LEGACY_DATA_FILE = 'data.json'
+FEEDBACK_FIELDS = ["timestamp", "feedback", "emotion", "reasoning"]
+DAILY_FILE = '_daily.json'
+CSV_CHUNK_ROWS = 500
+
+# Parsed contents of DATA_FILE plus the byte offset read so far; new
+# appends are parsed incrementally from that offset
+_CACHE = {'offset': 0, 'data': []}
+_CACHE_LOCK = threading.RLock()
+
+# Serialized dashboard data, rebuilt only when the cache has grown
+_PAYLOAD = {'offset': None, 'json': None}
+HTML_JSON_ESCAPES = (("<", "\\u003c"), (">", "\\u003e"), ("&", "\\u0026"), ("'", "\\u0027"))
+
+# LRU of classifications keyed by normalized feedback text, also the
+# contents of CLASSIFY_CACHE_FILE so it survives restarts
+CLASSIFY_CACHE_FILE = 'classify_cache.json'
+CLASSIFY_CACHE_SIZE = 4096
+CLASSIFY_CACHE_FLUSH_EVERY = 20
+_CLASSIFIED = {}
+_CLASSIFIED_STATE = {'unsaved': 0}
+_CLASSIFIED_LOCK = threading.Lock()
+# Serializes writers of CLASSIFY_CACHE_FILE and its shared .tmp file
+_CLASSIFY_SAVE_LOCK = threading.Lock()
+# Gemini calls currently running, keyed like the cache
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+# Per-day counts for the trend chart (date_str -> {'negative', 'total'}),
+# covering DATA_FILE up to 'offset'. Written to DAILY_FILE only every
+# DAILY_FLUSH_EVERY new entries and at exit; anything newer is recounted
+# from DATA_FILE on restart.
+DAILY_FLUSH_EVERY = 50
+_DAILY = {}
+_DAILY_STATE = {'offset': 0, 'unsaved': 0}
+# Single-slot memo of the day bucket last seen: [start_ts, end_ts, date_str]
+_DAY_SPAN = [0.0, 0.0, None]
 
 
 # ------------------ Utility Functions ------------------
 
-def load_data():
-    if not os.path.exists(DATA_FILE) or os.path.getsize(DATA_FILE) == 0:
-        return []
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return []
+def day_of(ts):
+    if not _DAY_SPAN[0] <= ts < _DAY_SPAN[1]:
+        day = datetime.date.fromtimestamp(ts)
+        start = datetime.datetime.combine(day, datetime.time())
+        end = start + datetime.timedelta(days=1)
+        _DAY_SPAN[:] = [start.timestamp(), end.timestamp(), day.isoformat()]
+    return _DAY_SPAN[2]
 
 
-def save_data(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4)
+def count_daily(entry):
+    counts = _DAILY.setdefault(day_of(entry["timestamp"]), {"negative": 0, "total": 0})
+    counts["total"] += 1
+    if entry["emotion"] in NEGATIVE_EMOTIONS:
+        counts["negative"] += 1
+    _DAILY_STATE['unsaved'] += 1
 
 
-def classify_emotion_gemini(text):
+def load_daily():
+    try:
+        with open(DAILY_FILE, 'rb') as f:
+            saved = orjson.loads(f.read())
+        _DAILY.update(saved['days'])
+        _DAILY_STATE['offset'] = saved['offset']
+    except (OSError, KeyError, TypeError, orjson.JSONDecodeError):
+        pass
+
+
+def save_daily():
+    with _CACHE_LOCK:
+        if not _DAILY_STATE['unsaved']:
+            return
+        tmp = DAILY_FILE + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(orjson.dumps({'offset': _DAILY_STATE['offset'], 'days': _DAILY}))
+            os.replace(tmp, DAILY_FILE)
+        except OSError as e:
+            # The aggregate can be rebuilt from DATA_FILE; keep 'unsaved' so the next flush retries
+            app.logger.warning("Could not save %s: %s", DAILY_FILE, e)
+            return
+        _DAILY_STATE['unsaved'] = 0
+
+
+def import_legacy_data():
+    if os.path.exists(DATA_FILE) or not os.path.exists(LEGACY_DATA_FILE):
+        return
+    try:
+        with open(LEGACY_DATA_FILE, 'rb') as f:
+            entries = orjson.loads(f.read() or b'[]')
+    except (OSError, orjson.JSONDecodeError):
+        return
+    tmp = DATA_FILE + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(b''.join(orjson.dumps(entry) + b'\n' for entry in entries))
+    os.replace(tmp, DATA_FILE)
+
+
+def is_feedback_entry(entry):
+    return (
+        isinstance(entry, dict)
+        and all(field in entry for field in FEEDBACK_FIELDS)
+        and isinstance(entry["timestamp"], (int, float))
+    )
+
+
+def read_entries(start, end):
+    # Yields (line_end_offset, entry) for each complete line of DATA_FILE in [start, end)
+    with open(DATA_FILE, 'rb') as f:
+        try:
+            buf, base = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), 0
+        except (OSError, ValueError):
+            # Fall back to a plain read where the file can't be mapped
+            f.seek(start)
+            buf, base = f.read(end - start), start
+    view = memoryview(buf)
     try:
-        prompt = (
-            f"Analyze the student feedback: \"{text}\".\n"
-            f"Choose one emotion from this list: {EMOTION_CATEGORIES}.\n"
-            "Respond in JSON with: emotion, reasoning."
-        )
+        pos = start
+        # Only consume complete lines; a partial trailing write is picked up next time
+        while (nl := buf.find(b'\n', pos - base, end - base)) != -1:
+            line = view[pos - base:nl]
+            pos = nl + 1 + base
+            try:
+                # orjson parses straight from the mapped pages, no copy
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Blank or corrupt line; still report its offset so it's not re-read
+                entry = None
+            finally:
+                line.release()
+            if not is_feedback_entry(entry):
+                # Valid JSON that isn't a feedback record is skipped the same way
+                entry = None
+            yield pos, entry
+    finally:
+        view.release()
+        if base == 0:
+            buf.close()
 
-        response = model.generate_content(
-            prompt,
-            generation_config={
-                "response_mime_type": "application/json"
-            }
-        )
 
-        return json.loads(response.text), 200
+def load_data():
+    with _CACHE_LOCK:
+        try:
+            size = os.stat(DATA_FILE).st_size
+        except FileNotFoundError:
+            size = 0
+        if size < _CACHE['offset'] or size < _DAILY_STATE['offset']:
+            # File was truncated, replaced or removed; start over
+            _CACHE['offset'], _CACHE['data'] = 0, []
+            # Offsets restart too, so the dashboard payload can't be matched by offset
+            _PAYLOAD['offset'] = None
+            _DAILY.clear()
+            _DAILY_STATE['offset'] = 0
+        if size == _CACHE['offset']:
+            return _CACHE['data']
+
+        try:
+            for pos, entry in read_entries(_CACHE['offset'], size):
+                _CACHE['offset'] = pos
+                if entry is None:
+                    continue
+                _CACHE['data'].append(entry)
+                # Lines already covered by the persisted aggregate aren't recounted
+                if pos > _DAILY_STATE['offset']:
+                    count_daily(entry)
+                    _DAILY_STATE['offset'] = pos
+        except OSError:
+            pass
+        return _CACHE['data']
+
+
+def append_data(entry):
+    with _CACHE_LOCK:
+        with open(DATA_FILE, 'ab') as f:
+            f.write(orjson.dumps(entry) + b'\n')
+        # Read the new line back rather than assuming it directly follows the
+        # cached offset; another process may have appended in between
+        load_data()
+        if _DAILY_STATE['unsaved'] >= DAILY_FLUSH_EVERY:
+            save_daily()
+
+
+def dashboard_payload():
+    with _CACHE_LOCK:
+        data = load_data()
+        if _PAYLOAD['offset'] != _CACHE['offset']:
+            # Escape like Jinja's tojson so feedback text can't close the <script> tag
+            # One array per field rather than repeating field names on every entry
+            payload = orjson.dumps({field: [entry[field] for entry in data] for field in FEEDBACK_FIELDS}).decode()
+            for char, escaped in HTML_JSON_ESCAPES:
+                payload = payload.replace(char, escaped)
+            _PAYLOAD['offset'] = _CACHE['offset']
+            _PAYLOAD['json'] = payload
+        return _PAYLOAD['json']
+
+
+def orjson_response(obj, status=200):
+    # Faster drop-in for jsonify()
+    return make_response(orjson.dumps(obj), status, {'Content-Type': 'application/json'})
+
+
+def load_classify_cache():
+    try:
+        with open(CLASSIFY_CACHE_FILE, 'rb') as f:
+            _CLASSIFIED.update(orjson.loads(f.read()))
+    except (OSError, ValueError, TypeError):
+        pass
+    # The file is in least- to most-recently used order; keep the newest
+    while len(_CLASSIFIED) > CLASSIFY_CACHE_SIZE:
+        del _CLASSIFIED[next(iter(_CLASSIFIED))]
+
+
+def save_classify_cache():
+    # Best-effort: a failed write is logged and retried on the next flush,
+    # never surfaced to the request that triggered it
+    with _CLASSIFY_SAVE_LOCK:
+        with _CLASSIFIED_LOCK:
+            unsaved = _CLASSIFIED_STATE['unsaved']
+            if not unsaved:
+                return
+            snapshot = dict(_CLASSIFIED)
+        tmp = CLASSIFY_CACHE_FILE + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(orjson.dumps(snapshot))
+            os.replace(tmp, CLASSIFY_CACHE_FILE)
+        except OSError as e:
+            app.logger.warning("Could not save %s: %s", CLASSIFY_CACHE_FILE, e)
+            return
+        with _CLASSIFIED_LOCK:
+            _CLASSIFIED_STATE['unsaved'] -= unsaved
+
+
+def remember_classification(key, emotion, reasoning):
+    with _CLASSIFIED_LOCK:
+        _CLASSIFIED.pop(key, None)
+        _CLASSIFIED[key] = [emotion, reasoning]
+        while len(_CLASSIFIED) > CLASSIFY_CACHE_SIZE:
+            del _CLASSIFIED[next(iter(_CLASSIFIED))]
+        _CLASSIFIED_STATE['unsaved'] += 1
+        flush = _CLASSIFIED_STATE['unsaved'] >= CLASSIFY_CACHE_FLUSH_EVERY
+    if flush:
+        save_classify_cache()
+
+
+def cached_classification(key):
+    with _CLASSIFIED_LOCK:
+        saved = _CLASSIFIED.pop(key, None)
+        if saved is None:
+            return None
+        # Re-insert so the dict's order stays least- to most-recently used
+        _CLASSIFIED[key] = saved
+    return tuple(saved)
+
+
+def classify_with_cache(key, text):
+    saved = cached_classification(key)
+    if saved is not None:
+        return saved
+
+    # The model sees the feedback as written; only the cache key is normalized
+    response = model.generate_content(f"Student feedback: \"{text}\"")
+
+    result = orjson.loads(response.text)
+    remember_classification(key, result["emotion"], result["reasoning"])
+    return result["emotion"], result["reasoning"]
+
+
+def classify_by_keywords(text):
+    if NEGATION_RE.search(text) or AMBIGUOUS_RE.search(text):
+        return None
+    matches = {}
+    for emotion, pattern in KEYWORD_PATTERNS.items():
+        hits = pattern.findall(text)
+        if hits:
+            matches[emotion] = hits
+    if len(matches) != 1:
+        return None
+    emotion, hits = matches.popitem()
+    if len(hits) < 2:
+        return None
+    return {"emotion": emotion, "reasoning": f"Heuristic keyword match: {', '.join(h.lower() for h in hits)}."}
+
+
+def classify_single_flight(key, text):
+    # Concurrent requests for the same text wait on the first one's API call
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = _INFLIGHT[key] = Future()
+    if leader:
+        try:
+            future.set_result(classify_with_cache(key, text))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _INFLIGHT_LOCK:
+                del _INFLIGHT[key]
+            if not future.done():
+                # Interrupted by a BaseException, which still propagates here;
+                # followers get an error instead of waiting forever
+                future.set_exception(RuntimeError("Classification was interrupted."))
+    return future.result()
+
+
+def classify_emotion_gemini(text):
+    result = classify_by_keywords(text)
+    if result is not None:
+        return result, 200
+
+    try:
+        # Repeated comments differing only in case/spacing share one API call
+        emotion, reasoning = classify_single_flight(' '.join(text.lower().split()), text)
+        return {"emotion": emotion, "reasoning": reasoning}, 200
 
     except Exception as e:
         return {"error": str(e)}, 500
@@ -96,13 +423,12 @@ def submit_feedback():
     feedback_text = request.form.get('feedback', '').strip()
 
     if not feedback_text:
-        return jsonify({"error": "Empty feedback."}), 400
+        return orjson_response({"error": "Empty feedback."}, 400)
 
     result, status = classify_emotion_gemini(feedback_text)
     if status != 200:
-        return jsonify(result), status
+        return orjson_response(result, status)
 
-    all_data = load_data()
     entry = {
         "timestamp": int(time.time()),
         "feedback": feedback_text,
@@ -110,15 +436,14 @@ def submit_feedback():
         "reasoning": result["reasoning"]
     }
 
-    all_data.append(entry)
-    save_data(all_data)
+    append_data(entry)
 
-    return jsonify(entry), 200
+    return orjson_response(entry)
 
 
 @app.route('/dashboard')
 def dashboard():
-    return render_template('teacher_dashboard.html', feedback_data=load_data())
+    return render_template('teacher_dashboard.html', feedback_json=Markup(dashboard_payload()))
 
 
 @app.route('/download_csv')
@@ -127,49 +452,57 @@ def download_csv():
     if not all_data:
         return "No data available.", 404
 
-    fieldnames = ["timestamp", "feedback", "emotion", "reasoning"]
+    # The cached list is append-only, so a fixed length gives a stable snapshot
+    count = len(all_data)
+    get_fields = itemgetter(*FEEDBACK_FIELDS)
 
-    si = StringIO()
-    cw = csv.DictWriter(si, fieldnames=fieldnames)
-    cw.writeheader()
-    cw.writerows(all_data)
+    def generate():
+        si = StringIO()
+        cw = csv.writer(si)
+        cw.writerow(FEEDBACK_FIELDS)
+        # Write in chunks so csv.writer's C loop does the work, not a Python loop per row
+        for start in range(0, count, CSV_CHUNK_ROWS):
+            cw.writerows(map(get_fields, all_data[start:min(start + CSV_CHUNK_ROWS, count)]))
+            yield si.getvalue()
+            si.seek(0)
+            si.truncate()
 
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=EduMood_Data.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=EduMood_Data.csv"}
+    )
 
 
 @app.route('/api/time_series_data')
 def time_series_data():
-    all_data = load_data()
-    if not all_data:
-        return jsonify([])
-
-    daily = {}
-
-    for entry in all_data:
-        date_str = datetime.datetime.fromtimestamp(entry["timestamp"]).strftime('%Y-%m-%d')
+    load_data()
+    with _CACHE_LOCK:
+        daily = sorted(_DAILY.items())
 
-        if date_str not in daily:
-            daily[date_str] = {"negative": 0, "total": 0}
-
-        daily[date_str]["total"] += 1
+    # Columnar arrays, as Chart.js consumes them, instead of one dict per day
+    result = {"date": [], "confusion_index": []}
+    for d, c in daily:
+        index = c["negative"] / c["total"]
+        result["date"].append(d)
+        result["confusion_index"].append(round(index, 3))
 
-        if entry["emotion"] in ["Confused", "Frustrated/Stressed", "Bored/Drowsy"]:
-            daily[date_str]["negative"] += 1
+    return orjson_response(result)
 
-    result = []
-    for d, c in sorted(daily.items()):
-        index = c["negative"] / c["total"]
-        result.append({
-            "date": d,
-            "confusion_index": round(index, 3)
-        })
 
-    return jsonify(result)
+# Restore the persisted aggregate and warm the cache once at startup
+with _CACHE_LOCK:
+    import_legacy_data()
+    load_daily()
+    load_data()
+load_classify_cache()
+atexit.register(save_classify_cache)
+atexit.register(save_daily)
 
 
 # ---------- MAIN ----------
 if __name__ == '__main__':
+    # Exit normally on SIGTERM so the atexit flushes run; gunicorn workers
+    # already do this, so the handler is only installed here
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(debug=True)
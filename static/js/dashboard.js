@@ -11,8 +11,8 @@ function getEmotionCounts(data) {
         "Frustrated/Stressed": 0,
     };
 
-    data.forEach(entry => {
-        const emotionKey = entry.emotion;
+    // data holds one array per field (timestamp, feedback, emotion, reasoning)
+    data.emotion.forEach(emotionKey => {
         if (counts.hasOwnProperty(emotionKey)) {
             counts[emotionKey]++;
         }
@@ -55,10 +55,10 @@ async function fetchAndRenderTrendChart() {
         const response = await fetch('/api/time_series_data');
         const trendData = await response.json();
         
-        if (trendData.length === 0) return;
+        if (trendData.date.length === 0) return;
 
-        const dates = trendData.map(d => d.date);
-        const indices = trendData.map(d => d.confusion_index);
+        const dates = trendData.date;
+        const indices = trendData.confusion_index;
 
         const ctx = document.getElementById('trendChart').getContext('2d');
         
@@ -104,12 +104,24 @@ function displayRawFeedback(data) {
     const list = document.getElementById('feedback-list');
     list.innerHTML = ''; 
     
-    if (data.length === 0) {
+    const total = data.timestamp.length;
+    if (total === 0) {
         list.innerHTML = '<div style="text-align: center; padding: 2rem; color: var(--text-light);"><div style="font-size: 3rem; margin-bottom: 1rem;">📝</div><p>No feedback data available yet. Start by submitting some feedback!</p></div>';
         return;
     }
     
-    data.reverse().slice(0, 10).forEach((entry, index) => { 
+    // Newest first, rebuilding entry objects only for the rows shown
+    const latest = [];
+    for (let i = total - 1; i >= Math.max(0, total - 10); i--) {
+        latest.push({
+            timestamp: data.timestamp[i],
+            feedback: data.feedback[i],
+            emotion: data.emotion[i],
+            reasoning: data.reasoning[i]
+        });
+    }
+
+    latest.forEach((entry, index) => { 
         const feedbackItem = document.createElement('div');
         feedbackItem.style.cssText = `
             background: rgba(255, 255, 255, 0.8);